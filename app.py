@@ -1,80 +1,366 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
+import atexit
+import contextvars
+import copy
+import hashlib
+import hmac
 import json
+import math
+import os
+import queue
+import re
+import secrets
+import sys
+import threading
+import time
+from bisect import bisect_right
 from datetime import datetime, timedelta
 from pytz import timezone
 import logging
-from concurrent.futures import ThreadPoolExecutor
-from flask_jwt_extended import create_access_token, JWTManager
+import logging.handlers
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from flask_jwt_extended import create_access_token, get_jwt, get_jwt_identity, jwt_required, JWTManager
 
 # Configure logging to suppress verbose "GET /..." output
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 
+# =======================================================
+# STRUCTURED LOGGING
+# =======================================================
+# Request threads only enqueue records; a QueueListener thread formats them as
+# JSON lines and writes them to stdout, so logging never blocks a request on I/O.
+# Repeats of the same event (message, user, cache type) beyond LOG_RATE_LIMIT per
+# window are dropped; a summary with the dropped count is logged when the window ends.
+
+LOG_LEVEL = logging.INFO
+LOG_RATE_LIMIT = 20
+LOG_RATE_WINDOW_SECONDS = 60
+
+class JSONLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'msg': record.getMessage(),
+            **getattr(record, 'fields', {}),
+        }
+        if record.exc_info:
+            entry['exc_type'] = record.exc_info[0].__name__
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # The stock prepare() renders the traceback into msg on the calling thread; keep exc_info
+        # on the record instead so JSONLogFormatter formats it on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_text = None
+        return record
+
+class RateLimitFilter(logging.Filter):
+    """Lets each (level, message, user, cache_type) through at most `limit` times per window."""
+
+    def __init__(self, limit, window_seconds):
+        super().__init__()
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record):
+        if getattr(record, 'rate_limit_exempt', False):
+            return True
+        fields = getattr(record, 'fields', {})
+        key = (record.levelno, record.msg, fields.get('user'), fields.get('cache_type'))
+        now = time.monotonic()
+        with self._lock:
+            window_start, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - window_start >= self.window_seconds:
+                window_start, count = now, 0
+            if count >= self.limit:
+                self._windows[key] = (window_start, count, suppressed + 1)
+                return False
+            self._windows[key] = (window_start, count + 1, suppressed)
+        return True
+
+    def flush_expired(self):
+        """Drops finished windows and returns (key, suppressed) for those that dropped records."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, (window_start, _, suppressed) in list(self._windows.items()):
+                if now - window_start >= self.window_seconds:
+                    del self._windows[key]
+                    if suppressed:
+                        expired.append((key, suppressed))
+        return expired
+
+def report_suppressed_logs(rate_limit_filter):
+    while True:
+        time.sleep(rate_limit_filter.window_seconds)
+        for (level, msg, user, cache_type), suppressed in rate_limit_filter.flush_expired():
+            fields = {'repeated_msg': msg, 'suppressed': suppressed, 'user': user, 'cache_type': cache_type}
+            logger.log(level, "Suppressed repeated log messages", extra={
+                'rate_limit_exempt': True, 'fields': {k: v for k, v in fields.items() if v is not None}})
+
+def user_ref(username):
+    # Roll numbers are easy to enumerate, so a plain hash would be reversible; key it with a server secret
+    digest = hmac.new(app.config["LOG_USER_HASH_SECRET"].encode(), str(username).encode(), hashlib.sha256)
+    return digest.hexdigest()[:16]
+
+def log_event(level, msg, user=None, exc_info=False, **fields):
+    # Checked up front so disabled levels cost nothing on the request path (no hashing, no dicts)
+    if not logger.isEnabledFor(level):
+        return
+    if user is not None:
+        fields['user'] = user_ref(user)
+    logger.log(level, msg, exc_info=exc_info, extra={'fields': {k: v for k, v in fields.items() if v is not None}})
+
+_log_queue = queue.SimpleQueue()
+_log_output = logging.StreamHandler(sys.stdout)
+_log_output.setFormatter(JSONLogFormatter())
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_output)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+logger = logging.getLogger('smartx')
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+_log_handler = StructuredQueueHandler(_log_queue)
+_log_rate_limit = RateLimitFilter(LOG_RATE_LIMIT, LOG_RATE_WINDOW_SECONDS)
+_log_handler.addFilter(_log_rate_limit)
+logger.addHandler(_log_handler)
+threading.Thread(target=report_suppressed_logs, args=(_log_rate_limit,), daemon=True).start()
+
+# =======================================================
+# CACHED RECORD TYPES
+# =======================================================
+# Cached rows are slotted objects rather than dicts so thousands of cached users
+# don't each carry their own copies of the key strings. Repeated values (subject
+# names, rooms, status codes) are interned. Records are turned into JSON only at
+# the response boundary by RecordJSONProvider.
+
+class CachedRecord:
+    __slots__ = ()
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+class CourseAttendance(CachedRecord):
+    __slots__ = ('name', 'conducted', 'attended', 'percentage', 'status', 'color_code')
+
+    def __init__(self, name, conducted, attended, percentage, status, color_code):
+        self.name = sys.intern(name)
+        self.conducted = conducted
+        self.attended = attended
+        self.percentage = percentage
+        self.status = sys.intern(status)
+        self.color_code = sys.intern(color_code)
+
+class TimetablePeriod(CachedRecord):
+    __slots__ = ('period_no', 'subject_full', 'subject_short', 'room', 'start_time', 'end_time')
+
+    def __init__(self, period_no, subject_full, subject_short, room, start_time='', end_time=''):
+        self.period_no = period_no
+        self.subject_full = sys.intern(subject_full)
+        self.subject_short = sys.intern(subject_short)
+        self.room = sys.intern(room)
+        self.start_time = sys.intern(start_time)
+        self.end_time = sys.intern(end_time)
+
+    def to_dict(self):
+        return {'period': f"Period - {self.period_no}", **super().to_dict()}
+
+class BioLogEntry(CachedRecord):
+    __slots__ = ('s_no', 'date', 'status')
+
+    def __init__(self, s_no, date, status):
+        self.s_no = s_no
+        self.date = sys.intern(date)
+        self.status = sys.intern(status)
+
+class LabDeadline(CachedRecord):
+    __slots__ = ('week', 'title', 'due_date_str', 'submitted')
+
+    def __init__(self, week, title, due_date_str, submitted):
+        self.week = sys.intern(week)
+        self.title = sys.intern(title)
+        self.due_date_str = sys.intern(due_date_str)
+        self.submitted = submitted
+
+class RecordJSONProvider(DefaultJSONProvider):
+    @staticmethod
+    def default(o):
+        if isinstance(o, CachedRecord):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
 # --- Setup Flask App ---
 app = Flask(__name__)
-# IMPORTANT: In a production environment, this secret key should be
-# stored securely (e.g., as an environment variable) and not hardcoded.
-app.config["JWT_SECRET_KEY"] = "a_super_secret_key_for_smartx_final"
+app.json = RecordJSONProvider(app)
+# Tokens are only verified by the batch API, which stays disabled unless a real signing key is set.
+# Without it, tokens are signed with a per-process key and can't be forged from the source.
+app.config["JWT_SECRET_KEY"] = os.environ.get("SMARTX_JWT_SECRET_KEY") or secrets.token_hex(32)
+app.config["BATCH_REFRESH_ENABLED"] = bool(os.environ.get("SMARTX_JWT_SECRET_KEY"))
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(days=30)
+# Key for the user references in logs. Without the env var a per-process key is used,
+# so references are only comparable within one server run.
+app.config["LOG_USER_HASH_SECRET"] = os.environ.get("SMARTX_LOG_USER_HASH_SECRET") or secrets.token_hex(32)
+# Comma-separated usernames of the operations team, the only accounts allowed to use the batch API.
+# Operators get their token from /api/login like everyone else, so each needs a samvidha
+# account that reaches the student dashboard.
+app.config["BATCH_OPERATORS"] = frozenset(
+    name.strip() for name in os.environ.get("SMARTX_BATCH_OPERATORS", "").split(",") if name.strip())
 jwt = JWTManager(app)
 
 # --- In-Memory Storage & Constants ---
 SESSIONS_CACHE = {}
 INDIA_TIMEZONE = timezone('Asia/Kolkata')
 CACHE_DURATION_MINUTES = 15
+UPSTREAM_POOL_SIZE = 32
+BATCH_MAX_USERS = 200
+BATCH_MAX_WORKERS = 16
+BATCH_BUDGET_USERS = 600
+BATCH_BUDGET_WINDOW_MINUTES = 60
+THROTTLE_BURST = 20
+THROTTLE_REFILL_PER_MINUTE = 30
+FORCED_REFRESH_BUDGET = 5
+FORCED_REFRESH_WINDOW_MINUTES = 60
+WEEK_DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
 
 # =======================================================
 # 1. CORE UTILITY AND SESSION FUNCTIONS
 # =======================================================
 
+# Throttling state of the current request (a ScrapePolicy), set by apply_throttling.
+# None means no throttling applies, e.g. batch refresh workers.
+REQUEST_POLICY = contextvars.ContextVar('request_policy', default=None)
+
+class ThrottledError(Exception):
+    """Raised when a throttled request needs data that was never cached."""
+
 def get_data_from_cache(user_id, cache_type):
     session_data = SESSIONS_CACHE.get(user_id, {})
     cache_ts = session_data.get(f'{cache_type}_cache_timestamp')
     cache_data = session_data.get(f'{cache_type}_cache_data')
+    policy = REQUEST_POLICY.get()
     now = datetime.now(INDIA_TIMEZONE)
-    if cache_ts and cache_data and now < cache_ts + timedelta(minutes=CACHE_DURATION_MINUTES):
-        print(f"[SERVER LOG] Returning fresh CACHED data for {user_id} - type: {cache_type}")
+    fresh = cache_ts and cache_data and now < cache_ts + timedelta(minutes=CACHE_DURATION_MINUTES)
+    if fresh and not (policy and policy.wants_refresh()):
+        log_event(logging.DEBUG, "Cache hit", user=user_id, cache_type=cache_type)
         return cache_data
-    print(f"[SERVER LOG] Cache stale for {user_id} - type: {cache_type}. Fetching new data.")
-    return None
+    # Only a request that is about to scrape is charged against the user's budget
+    if policy is None or policy.allow_scrape():
+        log_event(logging.DEBUG, "Forced refresh, bypassing cache" if fresh else "Cache stale, fetching new data",
+                  user=user_id, cache_type=cache_type)
+        return None
+    if cache_data:
+        log_event(logging.DEBUG, "Throttled, serving cached data", user=user_id, cache_type=cache_type)
+        return cache_data
+    raise ThrottledError(cache_type)
 
 def set_data_in_cache(user_id, cache_type, data):
     if user_id in SESSIONS_CACHE:
         SESSIONS_CACHE[user_id][f'{cache_type}_cache_timestamp'] = datetime.now(INDIA_TIMEZONE)
         SESSIONS_CACHE[user_id][f'{cache_type}_cache_data'] = data
-        print(f"[SERVER LOG] Stored new data in cache for {user_id} - type: {cache_type}")
+        log_event(logging.DEBUG, "Stored new data in cache", user=user_id, cache_type=cache_type)
+
+# One adapter mounted into every upstream session, so all users share a single connection pool
+UPSTREAM_ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=UPSTREAM_POOL_SIZE)
+
+def upstream_session(session_cookies=None):
+    # Not used as a context manager: closing the session would also close the shared pool
+    s = requests.Session()
+    s.mount('https://', UPSTREAM_ADAPTER)
+    if session_cookies:
+        s.cookies.update(session_cookies)
+    return s
+
+class SharedPages:
+    """Section-level pages (same content for every student of a section) fetched once per batch.
+
+    `fetch` returns the page text, or None when the upstream rejected the session; such
+    results are not shared and the next caller fetches with its own session instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pages = {}
+        self.fetched = 0
+        self.reused = 0
+
+    def get(self, key, fetch):
+        while True:
+            with self._lock:
+                future = self._pages.get(key)
+                owner = future is None
+                if owner:
+                    future = self._pages[key] = Future()
+            if not owner:
+                try:
+                    page = future.result()
+                except Exception:
+                    continue
+                if page is None:
+                    continue
+                with self._lock:
+                    self.reused += 1
+                return page
+            try:
+                page = fetch()
+            except Exception as e:
+                with self._lock:
+                    self._pages.pop(key, None)
+                future.set_exception(e)
+                raise
+            with self._lock:
+                if page is None:
+                    self._pages.pop(key, None)
+                else:
+                    self.fetched += 1
+            future.set_result(page)
+            return page
 
 def perform_login(username, password):
-    print(f"\n[SERVER LOG] Attempting to log in user: {username}...")
+    started = time.monotonic()
     headers = {'User-Agent': 'Mozilla/5.0', 'Referer': 'https://samvidha.iare.ac.in/index'}
     data = {'username': username, 'password': password}
-    with requests.Session() as s:
-        try:
-            s.get("https://samvidha.iare.ac.in/index", timeout=10)
-            s.post("https://samvidha.iare.ac.in/pages/login/checkUser.php", headers=headers, data=data, timeout=10)
-            response = s.get("https://samvidha.iare.ac.in/home", timeout=10)
-            if '<title>IARE - Dashboard - Student</title>' in response.text:
-                print(f"[SERVER LOG] Login successful for {username}.")
-                return {'cookies': s.cookies.get_dict()}
-            print(f"[SERVER LOG] Login FAILED for {username}. Credentials might be invalid.")
-            return None
-        except requests.exceptions.RequestException as e:
-            print(f"[SERVER LOG] NETWORK ERROR during login: {e}")
-            return None
+    s = upstream_session()
+    try:
+        s.get("https://samvidha.iare.ac.in/index", timeout=10)
+        s.post("https://samvidha.iare.ac.in/pages/login/checkUser.php", headers=headers, data=data, timeout=10)
+        response = s.get("https://samvidha.iare.ac.in/home", timeout=10)
+        duration_ms = round((time.monotonic() - started) * 1000)
+        if '<title>IARE - Dashboard - Student</title>' in response.text:
+            log_event(logging.INFO, "Login successful", user=username, duration_ms=duration_ms)
+            return {'cookies': s.cookies.get_dict()}
+        log_event(logging.INFO, "Login failed, credentials might be invalid", user=username, duration_ms=duration_ms)
+        return None
+    except requests.exceptions.RequestException as e:
+        log_event(logging.WARNING, "Network error during login", user=username, error=type(e).__name__,
+                  duration_ms=round((time.monotonic() - started) * 1000))
+        return None
 
 def fetch_secure_page(session_cookies, url):
+    started = time.monotonic()
     try:
-        with requests.Session() as s:
-            s.cookies.update(session_cookies)
-            response = s.get(url, timeout=15)
-            if '<title>IARE - Login</title>' in response.text or '/index' in response.url:
-                return "SESSION_EXPIRED", None
-            return "SUCCESS", response
-    except requests.exceptions.RequestException:
+        response = upstream_session(session_cookies).get(url, timeout=15)
+        log_event(logging.DEBUG, "Upstream fetch", url=url, status=response.status_code, duration_ms=round((time.monotonic() - started) * 1000))
+        if '<title>IARE - Login</title>' in response.text or '/index' in response.url:
+            return "SESSION_EXPIRED", None
+        return "SUCCESS", response
+    except requests.exceptions.RequestException as e:
+        log_event(logging.WARNING, "Upstream network error", url=url, error=type(e).__name__, duration_ms=round((time.monotonic() - started) * 1000))
         return "NETWORK_ERROR", None
     except Exception as e:
+        log_event(logging.ERROR, "Upstream fetch failed", url=url, exc_info=True)
         return f"GENERIC_ERROR: {e}", None
 
 # =======================================================
@@ -205,17 +491,17 @@ def fetch_attendance(username, session_cookies):
             if len(cells) > 8:
                 try:
                     percentage = float(cells[7])
-                    course_data = {
-                        "name": cells[2],
-                        "conducted": int(cells[5]),
-                        "attended": int(cells[6]),
-                        "percentage": percentage,
-                        "status": cells[8],
-                        "color_code": get_attendance_color(percentage)
-                    }
+                    course_data = CourseAttendance(
+                        name=cells[2],
+                        conducted=int(cells[5]),
+                        attended=int(cells[6]),
+                        percentage=percentage,
+                        status=cells[8],
+                        color_code=get_attendance_color(percentage)
+                    )
                     courses.append(course_data)
-                    total_conducted += course_data["conducted"]
-                    total_attended += course_data["attended"]
+                    total_conducted += course_data.conducted
+                    total_attended += course_data.attended
                 except (ValueError, IndexError):
                     continue
 
@@ -233,10 +519,126 @@ def fetch_attendance(username, session_cookies):
     except Exception as e:
         return {"error": f"Failed to parse attendance HTML: {e}"}
 
-def fetch_timetable(username, session_cookies):
+def time_to_minutes(hhmm):
+    hours, minutes = hhmm.split(':')
+    return int(hours) * 60 + int(minutes)
+
+def header_columns(header_rows):
+    """Yields (column_index, cell) for header cells, honouring rowspan and colspan."""
+    carried = {}
+    for row in header_rows:
+        col = 0
+        added = {}
+        for cell in row.find_all(['th', 'td'], recursive=False):
+            while carried.get(col):
+                col += 1
+            yield col, cell
+            colspan = int(cell.get('colspan') or 1)
+            rowspan = int(cell.get('rowspan') or 1)
+            if rowspan > 1:
+                added.update({c: rowspan for c in range(col, col + colspan)})
+            col += colspan
+        carried = {c: rows - 1 for c, rows in {**carried, **added}.items() if rows - 1 > 0}
+
+def parse_period_timings(header_rows):
+    """Maps header column index to a ("HH:MM", "HH:MM") range, from "09:00 - 10:00" style headers.
+
+    Column 0 holds the day name, so column N lines up with the Nth period cell of a day row.
+    Break/lunch columns are dropped: they have a time but no period.
+    """
+    ranges = {}
+    skipped = set()
+    for col, cell in header_columns(header_rows):
+        text = cell.get_text(' ', strip=True)
+        if re.search(r'break|lunch', text, re.IGNORECASE):
+            skipped.add(col)
+        match = re.search(r'(\d{1,2})[:.](\d{2})\s*(?:[AaPp][Mm])?\s*-\s*(\d{1,2})[:.](\d{2})', text)
+        if match and col > 0:
+            ranges[col] = tuple(int(g) for g in match.groups())
+
+    timings = {}
+    prev_end = None
+    for col in sorted(ranges):
+        start_h, start_m, end_h, end_m = ranges[col]
+        start, end = start_h * 60 + start_m, end_h * 60 + end_m
+        # Headers use 12-hour times without AM/PM; a range that runs backwards is in the afternoon
+        while prev_end is not None and start < prev_end and start < 12 * 60:
+            start += 12 * 60
+        while end <= start and end < 12 * 60:
+            end += 12 * 60
+        prev_end = end
+        if col not in skipped:
+            timings[col] = (f"{start // 60:02d}:{start % 60:02d}", f"{end // 60:02d}:{end % 60:02d}")
+    return timings
+
+def build_timetable_slots(timetable, timings):
+    """Day x period index used by the now/next lookups, with start/end minutes precomputed.
+
+    `timings` maps period number to its range; periods without one are kept in the index
+    but never placed on the clock.
+    """
+    order = sorted(timings, key=lambda period_no: time_to_minutes(timings[period_no][0]))
+    return {
+        'order': order,
+        'starts': [time_to_minutes(timings[period_no][0]) for period_no in order],
+        'ends': [time_to_minutes(timings[period_no][1]) for period_no in order],
+        'timings_complete': all(p.period_no in timings for periods in timetable.values() for p in periods),
+        'days': {day_name: {p.period_no: p for p in periods} for day_name, periods in timetable.items()},
+    }
+
+def build_timetable_response(timetable_data):
+    # today_schedule is derived per request so a cached timetable stays correct across midnight
+    today_name = datetime.now(INDIA_TIMEZONE).strftime('%A')
+    return {
+        "timetable": timetable_data['timetable'],
+        "period_timings": timetable_data['period_timings'],
+        "today_schedule": timetable_data['timetable'].get(today_name, []),
+    }
+
+def get_timetable_slots(username, session_cookies):
+    # The timetable only changes between semesters, so any cached index is served regardless of age
+    slots = SESSIONS_CACHE.get(username, {}).get('tt_slots_cache_data')
+    policy = REQUEST_POLICY.get()
+    if slots and not (policy and policy.wants_refresh()):
+        return slots
+    timetable_data = fetch_timetable(username, session_cookies)
+    if 'error' in timetable_data:
+        return timetable_data
+    return SESSIONS_CACHE.get(username, {}).get('tt_slots_cache_data') or {"error": "Timetable index unavailable."}
+
+def find_current_period(slots, now):
+    day_name = now.strftime('%A')
+    result = {"day": day_name, "time": now.strftime('%H:%M'), "timings_complete": slots['timings_complete'], "period": None}
+    minutes = now.hour * 60 + now.minute
+    idx = bisect_right(slots['starts'], minutes) - 1
+    if idx >= 0 and minutes < slots['ends'][idx]:
+        result['period'] = slots['days'].get(day_name, {}).get(slots['order'][idx])
+    return result
+
+def find_next_period(slots, now):
+    result = {"day": None, "date": None, "days_ahead": None, "time": now.strftime('%H:%M'),
+              "timings_complete": slots['timings_complete'], "period": None}
+    minutes = now.hour * 60 + now.minute
+    first_idx = bisect_right(slots['starts'], minutes)
+    today_idx = now.weekday()
+    # offset 7 is the same weekday next week, hence the explicit date/days_ahead
+    for offset in range(8):
+        day_name = WEEK_DAYS[(today_idx + offset) % 7]
+        day_slots = slots['days'].get(day_name)
+        if not day_slots:
+            continue
+        for period_no in slots['order'][first_idx if offset == 0 else 0:]:
+            period = day_slots.get(period_no)
+            if period:
+                result.update(day=day_name, date=(now.date() + timedelta(days=offset)).isoformat(),
+                              days_ahead=offset, period=period)
+                return result
+    return result
+
+def fetch_timetable(username, session_cookies, shared_pages=None):
     cached_data = get_data_from_cache(username, 'tt')
     if cached_data:
-        return cached_data
+        return build_timetable_response(cached_data)
 
     status, response = fetch_secure_page(session_cookies, 'https://samvidha.iare.ac.in/home?action=TT_std')
     if status != "SUCCESS":
@@ -254,10 +656,15 @@ def fetch_timetable(username, session_cookies):
 
         payload = {'ay': ay, 'sec_data': sec_data, 'btn_faculty_tt': 'show'}
 
-        with requests.Session() as s:
-            s.cookies.update(session_cookies)
-            r = s.post('https://samvidha.iare.ac.in/home?action=TT_std', data=payload, timeout=15)
-            soup = BeautifulSoup(r.text, 'lxml')
+        def fetch_section_timetable():
+            r = upstream_session(session_cookies).post('https://samvidha.iare.ac.in/home?action=TT_std', data=payload, timeout=15)
+            return None if '/index' in r.url else r.text
+
+        # The timetable page is the same for everyone in a section, so a batch fetches it once
+        html = shared_pages.get(('tt', ay, sec_data), fetch_section_timetable) if shared_pages else fetch_section_timetable()
+        if html is None:
+            return {"error": "SESSION_EXPIRED"}
+        soup = BeautifulSoup(html, 'lxml')
 
         tables = soup.find_all('table', class_='table-bordered')
         if len(tables) < 2:
@@ -310,12 +717,12 @@ def fetch_timetable(username, session_cookies):
                 if full_subject_name:
                     short_name = get_shortcut(full_subject_name)
 
-                    current_subject = {
-                        'period': f"Period - {i}",
-                        'subject_full': full_subject_name,
-                        'subject_short': short_name,
-                        'room': room
-                    }
+                    current_subject = TimetablePeriod(
+                        period_no=i,
+                        subject_full=full_subject_name,
+                        subject_short=short_name,
+                        room=room
+                    )
                     periods.append(current_subject)
 
                     if "Laboratory" in full_subject_name:
@@ -325,29 +732,40 @@ def fetch_timetable(username, session_cookies):
 
                 else:
                     if last_subject_info:
-                        continued_subject = last_subject_info.copy()
-                        continued_subject['period'] = f"Period - {i}"
-                        if room:
-                            continued_subject['room'] = room
+                        continued_subject = TimetablePeriod(
+                            period_no=i,
+                            subject_full=last_subject_info.subject_full,
+                            subject_short=last_subject_info.subject_short,
+                            room=room or last_subject_info.room
+                        )
                         periods.append(continued_subject)
                     else:
-                        periods.append({
-                            'period': f"Period - {i}",
-                            'subject_full': short_code,
-                            'subject_short': get_shortcut(short_code),
-                            'room': room
-                        })
+                        periods.append(TimetablePeriod(
+                            period_no=i,
+                            subject_full=short_code,
+                            subject_short=get_shortcut(short_code),
+                            room=room
+                        ))
                         last_subject_info = None
 
             if day_name and periods:
                 timetable[day_name] = periods
 
-        today_name = datetime.now(INDIA_TIMEZONE).strftime('%A')
-        today_schedule = timetable.get(today_name, [])
-
-        full_timetable_data = {"timetable": timetable, "today_schedule": today_schedule}
+        # Periods without a header time keep an empty start/end time: unknown, not guessed
+        timings = parse_period_timings(tables[0].find_all('tr')[:2])
+        for periods in timetable.values():
+            for period in periods:
+                start, end = timings.get(period.period_no, ('', ''))
+                period.start_time = sys.intern(start)
+                period.end_time = sys.intern(end)
+
+        full_timetable_data = {
+            "timetable": timetable,
+            "period_timings": [{'period_no': i, 'start_time': start, 'end_time': end} for i, (start, end) in sorted(timings.items())],
+        }
         set_data_in_cache(username, 'tt', full_timetable_data)
-        return full_timetable_data
+        set_data_in_cache(username, 'tt_slots', build_timetable_slots(timetable, timings))
+        return build_timetable_response(full_timetable_data)
 
     except Exception as e:
         return {"error": f"Failed to parse timetable HTML: {e}"}
@@ -392,11 +810,7 @@ def fetch_bio_log_data(username, session_cookies):
             date = row[3] if len(row) > 3 else ""
             status_text = row[status_col_index] if len(row) > status_col_index else ""
             if "present" in status_text.lower() or "absent" in status_text.lower():
-                bio_log.append({
-                    "s_no": s_no,
-                    "date": date,
-                    "status": status_text
-                })
+                bio_log.append(BioLogEntry(s_no=s_no, date=date, status=status_text))
 
         bio_data = {"bio_log": bio_log}
         set_data_in_cache(username, 'bio_log', bio_data)
@@ -411,7 +825,7 @@ def fetch_bio_summary(username, session_cookies):
     if 'error' in bio_log_data:
         return bio_log_data
 
-    present_days = sum(1 for log in bio_log_data['bio_log'] if log['status'] == 'P')
+    present_days = sum(1 for log in bio_log_data['bio_log'] if log.status == 'P')
     total_days = len(bio_log_data['bio_log'])
     percentage = (present_days / total_days * 100) if total_days > 0 else 0
 
@@ -421,44 +835,51 @@ def fetch_bio_summary(username, session_cookies):
         'percentage': round(percentage, 2)
     }
 
-def fetch_lab_deadlines_data(session_cookies, username):
+def fetch_lab_deadlines_data(session_cookies, username, shared_pages=None):
     cached_data = get_data_from_cache(username, 'lab')
     if cached_data: return cached_data
     main_url = 'https://samvidha.iare.ac.in/home?action=labrecord_std'
     details_url = 'https://samvidha.iare.ac.in/pages/student/lab_records/ajax/day2day.php'
     grouped_data = {}
     try:
-        with requests.Session() as s:
-            s.cookies.update(session_cookies)
-            main_page_response = s.get(main_url, timeout=15)
-            if '/index' in main_page_response.url: return {"error": "Session Expired"}
-            main_soup = BeautifulSoup(main_page_response.text, 'lxml')
-            ay = main_soup.find('input', {'name': 'ay'}).get('value')
-            rollno = main_soup.find('input', {'name': 'rollno'}).get('value')
-            subject_options = main_soup.select('select[name="ddlsub_code"] option')
-            subjects = [{'code': opt.get('value'), 'name': opt.text} for opt in subject_options if opt.get('value')]
-            for subject in subjects:
-                code = subject['code']
-                full_name = subject['name']
-                display_name = full_name.split(' - ')[-1].strip() if ' - ' in full_name else full_name
-                grouped_data[code] = {'subject_name': display_name, 'deadlines': []}
-                submitted_payload = {'rollno': rollno, 'ay': ay, 'sub_code': code, 'action': 'day2day_lab'}
-                submitted_response = s.post(details_url, data=submitted_payload, timeout=10)
-                submitted_json = submitted_response.json()
-                submitted_weeks = {item['week_no'] for item in submitted_json.get('data', [])}
-                all_labs_payload = {'ay': ay, 'sub_code': code, 'action': 'get_exp_list'}
+        s = upstream_session(session_cookies)
+        main_page_response = s.get(main_url, timeout=15)
+        if '/index' in main_page_response.url: return {"error": "Session Expired"}
+        main_soup = BeautifulSoup(main_page_response.text, 'lxml')
+        ay = main_soup.find('input', {'name': 'ay'}).get('value')
+        rollno = main_soup.find('input', {'name': 'rollno'}).get('value')
+        subject_options = main_soup.select('select[name="ddlsub_code"] option')
+        subjects = [{'code': opt.get('value'), 'name': opt.text} for opt in subject_options if opt.get('value')]
+        for subject in subjects:
+            code = subject['code']
+            full_name = subject['name']
+            display_name = full_name.split(' - ')[-1].strip() if ' - ' in full_name else full_name
+            grouped_data[code] = {'subject_name': sys.intern(display_name), 'deadlines': []}
+            submitted_payload = {'rollno': rollno, 'ay': ay, 'sub_code': code, 'action': 'day2day_lab'}
+            submitted_response = s.post(details_url, data=submitted_payload, timeout=10)
+            submitted_json = submitted_response.json()
+            submitted_weeks = {item['week_no'] for item in submitted_json.get('data', [])}
+            all_labs_payload = {'ay': ay, 'sub_code': code, 'action': 'get_exp_list'}
+
+            def fetch_experiment_list():
                 details_response = s.post(details_url, data=all_labs_payload, timeout=10)
-                details_soup = BeautifulSoup(details_response.text, 'lxml')
-                table = details_soup.find('table')
-                if not table: continue
-                for row in table.find_all('tr')[1:]:
-                    cells = [cell.get_text(strip=True) for cell in row.find_all('td')]
-                    if len(cells) >= 5:
-                        week_text = cells[0].replace('Week-', '').strip()
-                        is_submitted = week_text in submitted_weeks
-                        grouped_data[code]['deadlines'].append({"week": cells[0], "title": cells[2], "due_date_str": cells[4], "submitted": is_submitted})
-            set_data_in_cache(username, 'lab', grouped_data)
-            return grouped_data
+                return None if '/index' in details_response.url else details_response.text
+
+            # The experiment list depends only on the course, not the student
+            details_html = shared_pages.get(('lab', ay, code), fetch_experiment_list) if shared_pages else fetch_experiment_list()
+            if details_html is None:
+                continue
+            details_soup = BeautifulSoup(details_html, 'lxml')
+            table = details_soup.find('table')
+            if not table: continue
+            for row in table.find_all('tr')[1:]:
+                cells = [cell.get_text(strip=True) for cell in row.find_all('td')]
+                if len(cells) >= 5:
+                    week_text = cells[0].replace('Week-', '').strip()
+                    is_submitted = week_text in submitted_weeks
+                    grouped_data[code]['deadlines'].append(LabDeadline(week=cells[0], title=cells[2], due_date_str=cells[4], submitted=is_submitted))
+        set_data_in_cache(username, 'lab', grouped_data)
+        return grouped_data
     except Exception as e: return {"error": f"Failed to fetch lab data: {e}"}
 
 def fetch_results(username, session_cookies):
@@ -588,11 +1009,139 @@ def fetch_attendance_register(username, session_cookies):
         set_data_in_cache(username, 'attendance_register', result)
         return result
     except Exception as e:
-        import traceback
-        print(traceback.format_exc())
+        log_event(logging.ERROR, "Failed to parse attendance register", user=username, cache_type='attendance_register', exc_info=True)
         return {"error": f"Failed to parse attendance register: {e}"}
 
 
+# =======================================================
+# REQUEST THROTTLING
+# =======================================================
+
+class TokenBucket:
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, count=1):
+        """Takes `count` tokens. Returns 0 on success, otherwise the seconds until they are available."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+            self.updated = now
+            if self.tokens >= count:
+                self.tokens -= count
+                return 0
+            return (count - self.tokens) / self.refill_per_second
+
+    def refund(self, count=1):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + count)
+
+class ScrapePolicy:
+    """Throttling state of one request, shared with its worker threads through REQUEST_POLICY.
+
+    Without a bucket the request is never throttled (batch workers use force_refresh=True
+    that way). `refresh_bucket` is given only when the client asked for refresh=true.
+    """
+
+    def __init__(self, username, bucket=None, refresh_bucket=None, force_refresh=False):
+        self.username = username
+        self.bucket = bucket
+        self.refresh_bucket = refresh_bucket
+        self.force_refresh = force_refresh
+        self.retry_after = None
+        self._allowed = None if bucket else True
+        self._refresh_decided = force_refresh or refresh_bucket is None
+        self._lock = threading.Lock()
+
+    def _take_request_token(self):
+        # Caller holds self._lock
+        if self._allowed is None:
+            wait = self.bucket.take()
+            self._allowed = not wait
+            if wait:
+                self.retry_after = wait
+                log_event(logging.INFO, "Request throttled", user=self.username)
+        return self._allowed
+
+    def allow_scrape(self):
+        """Charges the user's bucket once, on the request's first cache miss."""
+        with self._lock:
+            return self._take_request_token()
+
+    def wants_refresh(self):
+        """Decides refresh=true once; the refresh budget is charged only when the scrape is granted."""
+        with self._lock:
+            if not self._refresh_decided:
+                self._refresh_decided = True
+                charged_now = self._allowed is None
+                if self._take_request_token():
+                    wait = self.refresh_bucket.take()
+                    if wait:
+                        # Not scraping after all, so give back a token taken just for this refresh
+                        if charged_now:
+                            self.bucket.refund()
+                            self._allowed = None
+                        self.retry_after = wait
+                        log_event(logging.INFO, "Forced refresh budget exhausted", user=self.username)
+                    else:
+                        self.force_refresh = True
+            return self.force_refresh
+
+# Throttling buckets live in the user's SESSIONS_CACHE entry, so they go away with the session
+THROTTLE_BUCKET_KEYS = ('request_bucket', 'refresh_bucket')
+
+def get_bucket(session_data, key, capacity, refill_per_second):
+    return session_data.get(key) or session_data.setdefault(key, TokenBucket(capacity, refill_per_second))
+
+def submit_in_context(executor, fn, *args):
+    # Executor threads don't inherit context variables; carry the request's policy over
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+def section_result(future):
+    # A throttled request still answers with every section that has a cached copy
+    try:
+        return future.result()
+    except ThrottledError:
+        return {"error": "THROTTLED"}
+
+def add_throttled_sections(response, sections):
+    throttled = [name for name, data in sections.items() if data.get('error') == 'THROTTLED']
+    if throttled:
+        response["throttled_sections"] = throttled
+    return response
+
+@app.before_request
+def apply_throttling():
+    REQUEST_POLICY.set(None)
+    # Only per-user data routes of logged-in users are throttled; unknown users get a 401 from the route
+    username = (request.view_args or {}).get('username')
+    session_data = SESSIONS_CACHE.get(username) if request.path.startswith('/api/') and username is not None else None
+    if not session_data:
+        return
+    bucket = get_bucket(session_data, 'request_bucket', THROTTLE_BURST, THROTTLE_REFILL_PER_MINUTE / 60)
+    refresh_bucket = None
+    if request.args.get('refresh') == 'true':
+        refresh_bucket = get_bucket(session_data, 'refresh_bucket', FORCED_REFRESH_BUDGET,
+                                    FORCED_REFRESH_BUDGET / (FORCED_REFRESH_WINDOW_MINUTES * 60))
+    REQUEST_POLICY.set(ScrapePolicy(username, bucket, refresh_bucket))
+
+@app.after_request
+def add_retry_after(response):
+    policy = REQUEST_POLICY.get()
+    if policy and policy.retry_after:
+        response.headers['Retry-After'] = str(math.ceil(policy.retry_after))
+    return response
+
+@app.errorhandler(ThrottledError)
+def handle_throttled(e):
+    response = jsonify({"error": "Too many requests and no cached data available yet"})
+    response.status_code = 429
+    return response
+
 # =======================================================
 # 3. API ENDPOINTS FOR FLUTTER APP
 # =======================================================
@@ -610,8 +1159,12 @@ def api_login():
     password = data['password']
     session_data = perform_login(username, password)
     if session_data:
+        # Keep throttling state across re-logins so logging in again doesn't reset the budget
+        previous = SESSIONS_CACHE.get(username, {})
+        session_data.update({key: previous[key] for key in THROTTLE_BUCKET_KEYS if key in previous})
         SESSIONS_CACHE[username] = session_data
-        access_token = create_access_token(identity=username)
+        claims = {"batch_operator": True} if username in app.config["BATCH_OPERATORS"] else {}
+        access_token = create_access_token(identity=username, additional_claims=claims)
         return jsonify({"message": "Login successful", "username": username, "token": access_token})
     else:
         return jsonify({"error": "Invalid credentials"}), 401
@@ -623,13 +1176,13 @@ def api_academic_info(username):
         return jsonify({"error": "User not logged in or session expired"}), 401
 
     with ThreadPoolExecutor(max_workers=3) as executor:
-        future_attendance = executor.submit(fetch_attendance, username, session_data['cookies'])
-        future_bio = executor.submit(fetch_bio_summary, username, session_data['cookies'])
-        future_results = executor.submit(fetch_results, username, session_data['cookies'])
+        future_attendance = submit_in_context(executor, fetch_attendance, username, session_data['cookies'])
+        future_bio = submit_in_context(executor, fetch_bio_summary, username, session_data['cookies'])
+        future_results = submit_in_context(executor, fetch_results, username, session_data['cookies'])
 
-        attendance_data = future_attendance.result()
-        bio_data = future_bio.result()
-        results_data = future_results.result()
+        attendance_data = section_result(future_attendance)
+        bio_data = section_result(future_bio)
+        results_data = section_result(future_results)
 
     class_attendance = attendance_data.get('overall_percentage', 0)
     bio_attendance = bio_data.get('percentage', 0)
@@ -651,12 +1204,14 @@ def api_academic_info(username):
             except (ValueError, TypeError):
                 continue
 
-    return jsonify({
+    response = {
         "class_attendance": class_attendance,
         "bio_attendance": bio_attendance,
         "sgpa": latest_sgpa,
         "cgpa": cgpa
-    })
+    }
+    sections = {"class_attendance": attendance_data, "bio_attendance": bio_data, "results": results_data}
+    return jsonify(add_throttled_sections(response, sections))
 
 @app.route('/api/dashboard/<username>')
 def api_dashboard(username):
@@ -664,34 +1219,37 @@ def api_dashboard(username):
     if not session_data: return jsonify({"error": "User not logged in or session expired"}), 401
 
     with ThreadPoolExecutor(max_workers=3) as executor:
-        future_timetable = executor.submit(fetch_timetable, username, session_data['cookies'])
-        future_bio_summary = executor.submit(fetch_bio_summary, username, session_data['cookies'])
-        future_labs = executor.submit(fetch_lab_deadlines_data, session_data['cookies'], username)
+        future_timetable = submit_in_context(executor, fetch_timetable, username, session_data['cookies'])
+        future_bio_summary = submit_in_context(executor, fetch_bio_summary, username, session_data['cookies'])
+        future_labs = submit_in_context(executor, fetch_lab_deadlines_data, session_data['cookies'], username)
 
-        timetable_data = future_timetable.result()
-        bio_summary_data = future_bio_summary.result()
-        lab_data = future_labs.result()
+        timetable_data = section_result(future_timetable)
+        bio_summary_data = section_result(future_bio_summary)
+        lab_data = section_result(future_labs)
 
     unsubmitted_labs = []
     if 'error' not in lab_data:
         all_deadlines = []
         for code, data in lab_data.items():
             for deadline in data['deadlines']:
-                if not deadline['submitted']:
+                if not deadline.submitted:
                     try:
-                        due_date = datetime.strptime(deadline['due_date_str'], '%d-%m-%Y').date()
-                        deadline['due_date_obj'] = due_date.isoformat()
-                        deadline['course_name'] = data['subject_name']
-                        all_deadlines.append(deadline)
+                        due_date = datetime.strptime(deadline.due_date_str, '%d-%m-%Y').date()
+                        deadline_entry = deadline.to_dict()
+                        deadline_entry['due_date_obj'] = due_date.isoformat()
+                        deadline_entry['course_name'] = data['subject_name']
+                        all_deadlines.append(deadline_entry)
                     except (ValueError, KeyError): continue
         upcoming_deadlines = sorted([d for d in all_deadlines if datetime.fromisoformat(d['due_date_obj']).date() >= datetime.now().date()], key=lambda x: x['due_date_obj'])
         unsubmitted_labs = upcoming_deadlines
 
-    return jsonify({
+    response = {
         "timetable_data": timetable_data,
         "bio_summary_data": bio_summary_data,
         "deadline_summary_data": {"unsubmitted_labs": unsubmitted_labs}
-    })
+    }
+    sections = {"timetable_data": timetable_data, "bio_summary_data": bio_summary_data, "deadline_summary_data": lab_data}
+    return jsonify(add_throttled_sections(response, sections))
 
 @app.route('/api/profile/<username>')
 def api_profile(username):
@@ -711,6 +1269,22 @@ def api_timetable(username):
     if not session_data: return jsonify({"error": "User not logged in"}), 401
     return jsonify(fetch_timetable(username, session_data['cookies']))
 
+def timetable_lookup(username, finder):
+    session_data = SESSIONS_CACHE.get(username)
+    if not session_data: return jsonify({"error": "User not logged in"}), 401
+    slots = get_timetable_slots(username, session_data['cookies'])
+    if 'error' in slots: return jsonify(slots), 500
+    if not slots['starts']: return jsonify({"error": "Period timings unavailable for this timetable."}), 404
+    return jsonify(finder(slots, datetime.now(INDIA_TIMEZONE)))
+
+@app.route('/api/timetable/now/<username>')
+def api_timetable_now(username):
+    return timetable_lookup(username, find_current_period)
+
+@app.route('/api/timetable/next/<username>')
+def api_timetable_next(username):
+    return timetable_lookup(username, find_next_period)
+
 @app.route('/api/bio/<username>')
 def api_bio(username):
     session_data = SESSIONS_CACHE.get(username)
@@ -749,6 +1323,120 @@ def api_attendance_register(username):
         return jsonify({"error": "User not logged in or session expired"}), 401
     return jsonify(fetch_attendance_register(username, session_data['cookies']))
 
+# Batch section name -> fetcher(username, cookies, shared_pages)
+BATCH_SECTIONS = {
+    'profile': lambda u, c, shared: scrape_profile_details(u, c),
+    'attendance': lambda u, c, shared: fetch_attendance(u, c),
+    'timetable': lambda u, c, shared: fetch_timetable(u, c, shared),
+    'bio': lambda u, c, shared: fetch_bio_log_data(u, c),
+    'results': lambda u, c, shared: fetch_results(u, c),
+    'labs': lambda u, c, shared: fetch_lab_deadlines_data(c, u, shared),
+    'attendance_register': lambda u, c, shared: fetch_attendance_register(u, c),
+}
+
+# Per-operator budget, counted in users refreshed; keyed by operator so it stays small
+BATCH_BUCKETS = {}
+
+def run_forced_refresh(fetcher, *args):
+    # Bypasses fresh cache for this worker only; the cache entry is replaced only if the scrape succeeds
+    REQUEST_POLICY.set(ScrapePolicy(None, force_refresh=True))
+    return fetcher(*args)
+
+def api_batch_refresh():
+    """Refreshes sections for many users and streams NDJSON results (registered below when enabled).
+
+    Needs SMARTX_JWT_SECRET_KEY and an /api/login token for a username in SMARTX_BATCH_OPERATORS.
+    """
+    operator = get_jwt_identity()
+    # Both the token claim and the current allowlist are required, so removing an operator takes effect at once
+    if not get_jwt().get('batch_operator') or operator not in app.config["BATCH_OPERATORS"]:
+        return jsonify({"error": "Batch refresh is restricted to operators"}), 403
+    data = request.get_json(silent=True)
+    if (not isinstance(data, dict) or not isinstance(data.get('usernames'), list) or not isinstance(data.get('sections'), list)
+            or not all(isinstance(item, str) for item in data['usernames'] + data['sections'])):
+        return jsonify({"error": "Request must be a JSON object with usernames and sections lists of strings"}), 400
+    usernames = list(dict.fromkeys(data['usernames']))
+    sections = list(dict.fromkeys(data['sections']))
+    unknown = [section for section in sections if section not in BATCH_SECTIONS]
+    if unknown:
+        return jsonify({"error": f"Unknown sections: {', '.join(map(str, unknown))}", "valid_sections": list(BATCH_SECTIONS)}), 400
+    if not usernames or not sections:
+        return jsonify({"error": "usernames and sections must not be empty"}), 400
+    if len(usernames) > BATCH_MAX_USERS:
+        return jsonify({"error": f"At most {BATCH_MAX_USERS} usernames per batch"}), 400
+    bucket = BATCH_BUCKETS.get(operator) or BATCH_BUCKETS.setdefault(
+        operator, TokenBucket(BATCH_BUDGET_USERS, BATCH_BUDGET_USERS / (BATCH_BUDGET_WINDOW_MINUTES * 60)))
+    wait = bucket.take(len(usernames))
+    if wait:
+        response = jsonify({"error": "Batch refresh budget exhausted"})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(math.ceil(wait))
+        return response
+    log_event(logging.INFO, "Batch refresh started", user=operator, users=len(usernames), sections=sections)
+
+    def generate():
+        started = time.monotonic()
+        shared_pages = SharedPages()
+        succeeded = failed = 0
+        pending = {}
+        results = {}
+        executor = ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(usernames) * len(sections)))
+        completed = False
+        try:
+            futures = {}
+            for username in usernames:
+                session_data = SESSIONS_CACHE.get(username)
+                if not session_data:
+                    failed += 1
+                    yield app.json.dumps({"username": username, "error": "User not logged in or session expired"}) + "\n"
+                    continue
+                pending[username] = len(sections)
+                results[username] = {}
+                for section in sections:
+                    future = submit_in_context(executor, run_forced_refresh, BATCH_SECTIONS[section], username, session_data['cookies'], shared_pages)
+                    futures[future] = (username, section)
+
+            for future in as_completed(futures):
+                username, section = futures[future]
+                try:
+                    results[username][section] = future.result()
+                except Exception as e:
+                    results[username][section] = {"error": f"Refresh failed: {e}"}
+                pending[username] -= 1
+                if pending[username]:
+                    continue
+                user_results = results.pop(username)
+                if any(isinstance(r, dict) and 'error' in r for r in user_results.values()):
+                    failed += 1
+                else:
+                    succeeded += 1
+                yield app.json.dumps({"username": username, "results": user_results}) + "\n"
+            completed = True
+        finally:
+            # If the client disconnects (GeneratorExit), drop queued scrapes instead of blocking on them
+            executor.shutdown(wait=completed, cancel_futures=not completed)
+
+        elapsed = time.monotonic() - started
+        log_event(logging.INFO, "Batch refresh finished", users=len(usernames), succeeded=succeeded, failed=failed,
+                  duration_ms=round(elapsed * 1000))
+        yield app.json.dumps({"stats": {
+            "users": len(usernames),
+            "succeeded": succeeded,
+            "failed": failed,
+            "sections": sections,
+            "elapsed_seconds": round(elapsed, 3),
+            "users_per_second": round(len(usernames) / elapsed, 2) if elapsed > 0 else None,
+            "shared_pages_fetched": shared_pages.fetched,
+            "shared_pages_reused": shared_pages.reused,
+        }}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+if app.config["BATCH_REFRESH_ENABLED"]:
+    app.add_url_rule('/api/batch/refresh', view_func=jwt_required()(api_batch_refresh), methods=['POST'])
+else:
+    log_event(logging.WARNING, "SMARTX_JWT_SECRET_KEY is not set; /api/batch/refresh is disabled")
+
 
 # --- MAIN RUN BLOCK ---
 if __name__ == '__main__':
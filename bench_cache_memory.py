@@ -0,0 +1,70 @@
+"""Bytes per cached user: plain dict rows vs. slotted, interned records.
+
+Builds a synthetic SESSIONS_CACHE entry (attendance, timetable, bio log and lab
+deadlines) for many users both ways and measures the heap growth with tracemalloc.
+
+    python bench_cache_memory.py [users]
+"""
+import sys
+import tracemalloc
+
+from app import BioLogEntry, CourseAttendance, LabDeadline, TimetablePeriod
+
+SUBJECTS = [
+    "Design and Analysis of Algorithms", "Operating Systems", "Computer Networks",
+    "Database Management Systems", "Operating Systems Laboratory", "Compiler Design",
+]
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+BIO_DAYS = 90
+LAB_WEEKS = 12
+
+
+def parsed(text):
+    # Scraped strings are fresh objects per user; mimic that instead of sharing literals
+    return text.encode().decode()
+
+
+def build_dict_user():
+    courses = [{"name": parsed(name), "conducted": 40, "attended": 34, "percentage": 85.0,
+                "status": parsed("Satisfactory"), "color_code": parsed("green")} for name in SUBJECTS]
+    timetable = {day: [{'period': parsed(f"Period - {i}"), 'period_no': i, 'subject_full': parsed(name),
+                        'subject_short': parsed(name[:4].upper()), 'room': parsed("3204"),
+                        'start_time': parsed("09:00"), 'end_time': parsed("10:00")}
+                       for i, name in enumerate(SUBJECTS, 1)] for day in DAYS}
+    bio_log = [{"s_no": parsed(str(i)), "date": parsed(f"{i % 28 + 1:02d}-10-2026"), "status": parsed("P")}
+               for i in range(BIO_DAYS)]
+    labs = {parsed(f"ACS{n}"): {'subject_name': parsed(SUBJECTS[4]), 'deadlines': [
+        {"week": parsed(f"Week-{w}"), "title": parsed(f"Experiment {w}"), "due_date_str": parsed("20-10-2026"), "submitted": False}
+        for w in range(LAB_WEEKS)]} for n in range(2)}
+    return {'att': {"courses": courses}, 'tt': {"timetable": timetable}, 'bio_log': {"bio_log": bio_log}, 'lab': labs}
+
+
+def build_record_user():
+    courses = [CourseAttendance(parsed(name), 40, 34, 85.0, parsed("Satisfactory"), parsed("green")) for name in SUBJECTS]
+    timetable = {day: [TimetablePeriod(i, parsed(name), parsed(name[:4].upper()), parsed("3204"), parsed("09:00"), parsed("10:00"))
+                       for i, name in enumerate(SUBJECTS, 1)] for day in DAYS}
+    bio_log = [BioLogEntry(parsed(str(i)), parsed(f"{i % 28 + 1:02d}-10-2026"), parsed("P")) for i in range(BIO_DAYS)]
+    labs = {parsed(f"ACS{n}"): {'subject_name': sys.intern(parsed(SUBJECTS[4])), 'deadlines': [
+        LabDeadline(parsed(f"Week-{w}"), parsed(f"Experiment {w}"), parsed("20-10-2026"), False)
+        for w in range(LAB_WEEKS)]} for n in range(2)}
+    return {'att': {"courses": courses}, 'tt': {"timetable": timetable}, 'bio_log': {"bio_log": bio_log}, 'lab': labs}
+
+
+def bytes_per_user(builder, users):
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    cache = {f"user{n}": builder() for n in range(users)}
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del cache
+    return (current - baseline) / users
+
+
+if __name__ == '__main__':
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    before = bytes_per_user(build_dict_user, users)
+    after = bytes_per_user(build_record_user, users)
+    print(f"users:           {users}")
+    print(f"dict rows:       {before:,.0f} bytes/user")
+    print(f"slotted records: {after:,.0f} bytes/user")
+    print(f"saved:           {(1 - after / before) * 100:.1f}%")
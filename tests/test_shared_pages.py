@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+
+from app import SharedPages
+
+
+def start_waiter(shared, key, fetch):
+    result = {}
+
+    def run():
+        try:
+            result['page'] = shared.get(key, fetch)
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+def blocking_owner_fetch(outcome):
+    """A fetch that blocks until released, then returns or raises `outcome`."""
+    started, release = threading.Event(), threading.Event()
+
+    def fetch():
+        started.set()
+        release.wait(5)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return fetch, started, release
+
+
+def test_waiter_fetches_with_own_session_when_owner_gets_none():
+    shared = SharedPages()
+    owner_fetch, started, release = blocking_owner_fetch(None)
+    waiter_calls = []
+
+    def waiter_fetch():
+        waiter_calls.append(1)
+        return "<html>timetable</html>"
+
+    owner, owner_result = start_waiter(shared, 'tt', owner_fetch)
+    assert started.wait(5)
+    waiter, waiter_result = start_waiter(shared, 'tt', waiter_fetch)
+    time.sleep(0.05)  # let the waiter block on the owner's future
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+
+    assert owner_result == {'page': None}
+    assert waiter_result == {'page': "<html>timetable</html>"}
+    assert waiter_calls == [1]
+    # The waiter's page is shared from now on
+    assert shared.get('tt', lambda: pytest.fail("should not refetch")) == "<html>timetable</html>"
+    assert (shared.fetched, shared.reused) == (1, 1)
+
+
+def test_owner_exception_does_not_poison_key():
+    shared = SharedPages()
+    owner_fetch, started, release = blocking_owner_fetch(RuntimeError("upstream down"))
+
+    owner, owner_result = start_waiter(shared, 'lab', owner_fetch)
+    assert started.wait(5)
+    waiter, waiter_result = start_waiter(shared, 'lab', lambda: "<table></table>")
+    time.sleep(0.05)
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+
+    assert isinstance(owner_result['error'], RuntimeError)
+    assert waiter_result == {'page': "<table></table>"}
+    assert shared.get('lab', lambda: pytest.fail("should not refetch")) == "<table></table>"
+
+
+def test_exception_without_waiters_leaves_key_fetchable():
+    shared = SharedPages()
+
+    def failing():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        shared.get('k', failing)
+    assert shared.get('k', lambda: "page") == "page"
+    assert shared.fetched == 1